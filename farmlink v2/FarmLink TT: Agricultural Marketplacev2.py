@@ -1,28 +1,36 @@
 # farmlink_tt.py - Production-Grade Agricultural Marketplace
 import re
+import io
+import csv
 import json
+import time
 import logging
+import threading
 import stripe 
 import requests
-from decimal import Decimal
+from collections import deque
+from decimal import Decimal, ROUND_HALF_UP
 from datetime import timedelta
-from django.db import models, transaction
+from django.db import models, transaction, connection
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth import authenticate, login
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator, EmptyPage
 from django.db.models import Q, F, CheckConstraint, Sum
+from django.db.models.functions import TruncWeek
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.core.cache import cache
 from django.urls import path
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
-from django.core.mail import send_mail
+from django.core.mail import send_mail, send_mass_mail
 from django.template.loader import render_to_string
 from geopy.distance import geodesic
 from rest_framework.views import APIView
@@ -193,30 +201,111 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     related_object_id = models.PositiveIntegerField(null=True, blank=True)
 
+class FXRate(models.Model):
+    currency_code = models.CharField(max_length=3, primary_key=True)
+    rate = models.DecimalField(max_digits=14, decimal_places=6)  # Units of currency per 1 base currency
+    updated_at = models.DateTimeField(auto_now=True)
+
+class PriceBookEntry(models.Model):
+    # Materialized local price of a product for buyers in one country
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='price_book')
+    country = models.ForeignKey(CARICOMCountry, on_delete=models.CASCADE)
+    currency_code = models.CharField(max_length=3)
+    base_price = models.DecimalField(max_digits=8, decimal_places=2)
+    fx_rate = models.DecimalField(max_digits=14, decimal_places=6)
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    price_with_tax = models.DecimalField(max_digits=12, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['country', 'product']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'country'],
+                name='unique_price_book_entry'
+            )
+        ]
+
+class ProductCooccurrence(models.Model):
+    # Sparse co-purchase counts, one row per ordered product pair
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-count']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'other'],
+                name='unique_product_cooccurrence'
+            )
+        ]
+
+class ProductRecommendation(models.Model):
+    # Top-K co-purchased products, served with a single primary key lookup
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='recommendations')
+    neighbours = models.JSONField(default=list)  # [[product_id, count], ...] best first
+    updated_at = models.DateTimeField(auto_now=True)
+
+class MarketPriceIndex(models.Model):
+    # Rolling price statistics per category, region, normalized unit and week
+    category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE)
+    region = models.CharField(max_length=50)
+    unit = models.CharField(max_length=5)  # Normalized unit: kg, crt, bnd or ea
+    week_start = models.DateField()
+    median_price = models.DecimalField(max_digits=10, decimal_places=2)
+    p25_price = models.DecimalField(max_digits=10, decimal_places=2)
+    p75_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.DecimalField(max_digits=14, decimal_places=3)  # Volume in normalized units
+    sample_count = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['region', 'category', 'week_start']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'region', 'unit', 'week_start'],
+                name='unique_market_price_index'
+            )
+        ]
+
 # ======================
 # UTILITIES & SERVICES (UPDATED)
 # ======================
 class DataValidator:
+    # Patterns compiled once at import
+    UPPERCASE_RE = re.compile(r"[A-Z]")
+    LOWERCASE_RE = re.compile(r"[a-z]")
+    DIGIT_RE = re.compile(r"[0-9]")
+    EMAIL_RE = re.compile(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")
+    UNSAFE_CHARS_RE = re.compile(r'[<>"\']')
+
     @staticmethod
     def validate_password(password):
         if len(password) < 8:
             return False, "Password must be at least 8 characters"
-        if not re.search(r"[A-Z]", password):
+        if not DataValidator.UPPERCASE_RE.search(password):
             return False, "Password must contain an uppercase letter"
-        if not re.search(r"[a-z]", password):
+        if not DataValidator.LOWERCASE_RE.search(password):
             return False, "Password must contain a lowercase letter"
-        if not re.search(r"[0-9]", password):
+        if not DataValidator.DIGIT_RE.search(password):
             return False, "Password must contain a digit"
         return True, ""
 
     @staticmethod
     def validate_email(email):
-        pattern = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-        return bool(re.match(pattern, email))
+        return bool(DataValidator.EMAIL_RE.match(email))
 
     @staticmethod
     def sanitize_input(text):
-        return re.sub(r'[<>"\']', '', text).strip() if text else text
+        return DataValidator.UNSAFE_CHARS_RE.sub('', text).strip() if text else text
     
     @staticmethod
     def validate_location(location):
@@ -270,16 +359,140 @@ class PaymentService:
             logger.error(f"Payment confirmation error: {str(e)}")
             return None
 
+class InProcessEventChannel:
+    # Single-process backend for tests and local development
+    def __init__(self, buffer_size=100):
+        self.buffer_size = buffer_size
+        self.condition = threading.Condition()
+        self.events = {}
+        self.last_ids = {}
+    
+    def publish(self, user_id, event_type, data):
+        with self.condition:
+            event_id = self.last_ids.get(user_id, 0) + 1
+            self.last_ids[user_id] = event_id
+            self.events.setdefault(user_id, deque(maxlen=self.buffer_size)).append(
+                {'id': event_id, 'type': event_type, 'data': data}
+            )
+            self.condition.notify_all()
+        return event_id
+    
+    def publish_many(self, events):
+        return [self.publish(user_id, event_type, data) for user_id, event_type, data in events]
+    
+    def latest_id(self, user_id):
+        with self.condition:
+            return self.last_ids.get(user_id, 0)
+    
+    def read(self, user_id, last_event_id, timeout):
+        # Events newer than last_event_id, waiting up to timeout for one to arrive
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_ids.get(user_id, 0) > last_event_id, timeout)
+            return [event for event in self.events.get(user_id, ()) if event['id'] > last_event_id]
+
+class CacheEventChannel:
+    # Shared by every gunicorn worker through the Django cache
+    def __init__(self, buffer_size=100, ttl=3600, poll_interval=1, gap_grace=5):
+        self.buffer_size = buffer_size
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.gap_grace = gap_grace
+    
+    def publish(self, user_id, event_type, data):
+        sequence_key = f'events:{user_id}:seq'
+        cache.add(sequence_key, 0, timeout=None)
+        event_id = cache.incr(sequence_key)
+        cache.set(
+            f'events:{user_id}:{event_id}',
+            {'id': event_id, 'type': event_type, 'data': data},
+            timeout=self.ttl
+        )
+        return event_id
+    
+    def publish_many(self, events):
+        # One sequence bump per user and a single set_many for the whole batch
+        by_user = {}
+        for user_id, event_type, data in events:
+            by_user.setdefault(user_id, []).append((event_type, data))
+        
+        entries = {}
+        for user_id, user_events in by_user.items():
+            sequence_key = f'events:{user_id}:seq'
+            cache.add(sequence_key, 0, timeout=None)
+            last_id = cache.incr(sequence_key, len(user_events))
+            for event_id, (event_type, data) in enumerate(user_events, last_id - len(user_events) + 1):
+                entries[f'events:{user_id}:{event_id}'] = {'id': event_id, 'type': event_type, 'data': data}
+        cache.set_many(entries, timeout=self.ttl)
+    
+    def latest_id(self, user_id):
+        return cache.get(f'events:{user_id}:seq', 0)
+    
+    def read(self, user_id, last_event_id, timeout):
+        # Publishers take an id with incr() before writing its payload, so ids can
+        # land out of order. Only the run of events up to the first missing id is
+        # returned; a missing id is given up on as lost after gap_grace seconds.
+        deadline = time.monotonic() + timeout
+        gap_since = None
+        while True:
+            latest = self.latest_id(user_id)
+            if latest > last_event_id:
+                first = max(last_event_id + 1, latest - self.buffer_size + 1)
+                keys = [f'events:{user_id}:{event_id}' for event_id in range(first, latest + 1)]
+                found = cache.get_many(keys)
+                events = []
+                for key in keys:
+                    if key not in found:
+                        break
+                    events.append(found[key])
+                if events:
+                    return events
+                
+                now = time.monotonic()
+                if gap_since is None:
+                    gap_since = now
+                elif now - gap_since >= self.gap_grace:
+                    events = [found[key] for key in keys if key in found]
+                    if events:
+                        return events
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(self.poll_interval)
+
+EVENT_CHANNEL_BACKENDS = {
+    'memory': InProcessEventChannel,
+    'cache': CacheEventChannel,
+}
+_event_channel = None
+
+def get_event_channel():
+    global _event_channel
+    if _event_channel is None:
+        backend = getattr(settings, 'EVENT_CHANNEL_BACKEND', 'cache')
+        _event_channel = EVENT_CHANNEL_BACKENDS[backend]()
+    return _event_channel
+
 class NotificationService:
     @staticmethod
     def send_notification(user, message, notif_type, related_id=None):
-        Notification.objects.create(
+        notification = Notification.objects.create(
             user=user,
             message=message,
             notification_type=notif_type,
             related_object_id=related_id
         )
         
+        # Push to the user's event stream once the surrounding transaction commits;
+        # best effort like the email below, so channel errors are logged, not raised
+        event = {
+            'notification_id': notification.id,
+            'message': message,
+            'related_object_id': related_id
+        }
+        transaction.on_commit(
+            lambda: get_event_channel().publish(user.id, notif_type, event),
+            robust=True
+        )
+        
         # Also send email for critical notifications
         if notif_type in ['order', 'payment']:
             subject = f"FarmLink Notification: {notif_type.capitalize()}"
@@ -290,6 +503,52 @@ class NotificationService:
                 [user.email],
                 fail_silently=True,
             )
+    
+    @staticmethod
+    def send_bulk_notifications(notifications):
+        # notifications: [(user, message, notif_type, related_id), ...]
+        created = Notification.objects.bulk_create([
+            Notification(
+                user=user,
+                message=message,
+                notification_type=notif_type,
+                related_object_id=related_id
+            )
+            for user, message, notif_type, related_id in notifications
+        ])
+        
+        events = [
+            (notification.user_id, notification.notification_type, {
+                'notification_id': notification.id,
+                'message': notification.message,
+                'related_object_id': notification.related_object_id
+            })
+            for notification in created
+        ]
+        emails = [
+            (
+                f"FarmLink Notification: {notif_type.capitalize()}",
+                message,
+                settings.DEFAULT_FROM_EMAIL,
+                [user.email]
+            )
+            for user, message, notif_type, _ in notifications
+            if notif_type in ['order', 'payment']
+        ]
+        
+        def dispatch():
+            # Emails go out over one SMTP connection without holding up the request;
+            # started first so an event channel failure cannot drop them
+            if emails:
+                threading.Thread(
+                    target=send_mass_mail,
+                    args=(emails,),
+                    kwargs={'fail_silently': True},
+                    daemon=True
+                ).start()
+            get_event_channel().publish_many(events)
+        
+        transaction.on_commit(dispatch, robust=True)
 
 class SearchService:
     @staticmethod
@@ -307,6 +566,402 @@ class SearchService:
             Q(farmer__farm_name__icontains=query)
         )
 
+class PriceBookService:
+    BATCH_SIZE = 1000
+    CENT = Decimal('0.01')
+    UPDATE_FIELDS = [
+        'currency_code', 'base_price', 'fx_rate', 'tax_rate',
+        'price', 'price_with_tax', 'updated_at'
+    ]
+    
+    @staticmethod
+    def load_fx_rates(path=None):
+        # Rates file: {"base": "TTD", "rates": {"JMD": "23.05", ...}}
+        with open(path or settings.FX_RATES_FILE) as f:
+            rates = json.load(f)['rates']
+        
+        existing = dict(FXRate.objects.values_list('currency_code', 'rate'))
+        changed = []
+        for code, rate in rates.items():
+            rate = Decimal(str(rate))
+            if existing.get(code) != rate:
+                # post_save refreshes the price book for this currency
+                FXRate.objects.update_or_create(currency_code=code, defaults={'rate': rate})
+                changed.append(code)
+        return changed
+    
+    @staticmethod
+    def build_entry(product_id, base_price, country, fx_rate):
+        cent = PriceBookService.CENT
+        price = (base_price * fx_rate).quantize(cent, rounding=ROUND_HALF_UP)
+        tax = price * country.tax_rate / 100
+        return PriceBookEntry(
+            product_id=product_id,
+            country=country,
+            currency_code=country.currency_code,
+            base_price=base_price,
+            fx_rate=fx_rate,
+            tax_rate=country.tax_rate,
+            price=price,
+            price_with_tax=(price + tax).quantize(cent, rounding=ROUND_HALF_UP)
+        )
+    
+    @staticmethod
+    def upsert(entries):
+        PriceBookEntry.objects.bulk_create(
+            entries,
+            batch_size=PriceBookService.BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product', 'country'],
+            update_fields=PriceBookService.UPDATE_FIELDS
+        )
+    
+    @staticmethod
+    def refresh_product(product):
+        rates = dict(FXRate.objects.values_list('currency_code', 'rate'))
+        base_price = Decimal(str(product.price))
+        PriceBookService.upsert([
+            PriceBookService.build_entry(product.id, base_price, country, rates[country.currency_code])
+            for country in CARICOMCountry.objects.filter(currency_code__in=rates)
+        ])
+    
+    @staticmethod
+    def refresh_country(country):
+        try:
+            fx_rate = FXRate.objects.get(currency_code=country.currency_code).rate
+        except FXRate.DoesNotExist:
+            # Drop entries priced in a previous currency rather than mislabel them
+            logger.warning(f"No FX rate for {country.currency_code}, price book cleared for {country.code}")
+            PriceBookEntry.objects.filter(country=country).delete()
+            return
+        
+        # Skip the rebuild when every entry already reflects the current rate and tax
+        entries = PriceBookEntry.objects.filter(country=country)
+        stale = entries.exclude(
+            currency_code=country.currency_code,
+            fx_rate=fx_rate,
+            tax_rate=country.tax_rate
+        )
+        if entries.exists() and not stale.exists():
+            return
+        
+        batch = []
+        for product_id, price in Product.objects.values_list('id', 'price').iterator(
+            chunk_size=PriceBookService.BATCH_SIZE
+        ):
+            batch.append(PriceBookService.build_entry(product_id, price, country, fx_rate))
+            if len(batch) >= PriceBookService.BATCH_SIZE:
+                PriceBookService.upsert(batch)
+                batch = []
+        if batch:
+            PriceBookService.upsert(batch)
+    
+    @staticmethod
+    def local_prices(country, product_ids):
+        return {
+            entry.product_id: entry
+            for entry in PriceBookEntry.objects.filter(country=country, product_id__in=product_ids)
+        }
+
+class RecommendationService:
+    TOP_K = 10
+    BATCH_SIZE = 1000
+    PAID_STATUSES = ['paid', 'shipped', 'delivered']
+    LOCK_KEY = 28  # Advisory lock serialising rebuilds with incremental updates
+    
+    @staticmethod
+    def lock():
+        # Postgres advisory lock, held until the surrounding transaction ends
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [RecommendationService.LOCK_KEY])
+    
+    @staticmethod
+    def rebuild():
+        # Full offline rebuild from paid order history using sparse matrices. The
+        # history read and the rewrite share one locked transaction so that no
+        # concurrent record_order increment is read around and then wiped.
+        import numpy as np
+        from scipy import sparse
+        
+        with transaction.atomic():
+            RecommendationService.lock()
+            
+            batch_size = RecommendationService.BATCH_SIZE
+            pairs = np.array(
+                OrderItem.objects.filter(
+                    order__status__in=RecommendationService.PAID_STATUSES
+                ).values_list('order_id', 'product_id').distinct(),
+                dtype=np.int64
+            ).reshape(-1, 2)
+            
+            # Orders x products incidence matrix; X^T X counts co-purchases
+            order_ids, order_idx = np.unique(pairs[:, 0], return_inverse=True)
+            product_ids, product_idx = np.unique(pairs[:, 1], return_inverse=True)
+            incidence = sparse.csr_matrix(
+                (np.ones(len(pairs), dtype=np.int32), (order_idx, product_idx)),
+                shape=(len(order_ids), len(product_ids))
+            )
+            counts = (incidence.T @ incidence).tocoo()
+            off_diagonal = counts.row != counts.col
+            rows = counts.row[off_diagonal]
+            cols = counts.col[off_diagonal]
+            data = counts.data[off_diagonal]
+            
+            # Rank neighbours within each product: highest count first, product id breaks ties
+            order = np.lexsort((product_ids[cols], -data, rows))
+            rows, cols, data = rows[order], cols[order], data[order]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+            top = rank < RecommendationService.TOP_K
+            
+            neighbours = {}
+            for row, col, count in zip(rows[top], cols[top], data[top]):
+                neighbours.setdefault(int(product_ids[row]), []).append([int(product_ids[col]), int(count)])
+            
+            ProductCooccurrence.objects.all().delete()
+            for start in range(0, len(rows), batch_size):
+                ProductCooccurrence.objects.bulk_create([
+                    ProductCooccurrence(product_id=int(product_ids[row]), other_id=int(product_ids[col]), count=int(count))
+                    for row, col, count in zip(
+                        rows[start:start + batch_size],
+                        cols[start:start + batch_size],
+                        data[start:start + batch_size]
+                    )
+                ])
+            
+            ProductRecommendation.objects.all().delete()
+            ProductRecommendation.objects.bulk_create([
+                ProductRecommendation(product_id=product_id, neighbours=items)
+                for product_id, items in neighbours.items()
+            ], batch_size=batch_size)
+            
+            return len(neighbours)
+    
+    @staticmethod
+    def record_order(order):
+        # Incremental update: bump pair counts for one newly paid order
+        product_ids = set(order.items.values_list('product_id', flat=True))
+        if len(product_ids) < 2:
+            return
+        
+        with transaction.atomic():
+            RecommendationService.lock()
+            ProductCooccurrence.objects.bulk_create([
+                ProductCooccurrence(product_id=a, other_id=b, count=0)
+                for a in product_ids for b in product_ids if a != b
+            ], ignore_conflicts=True)
+            ProductCooccurrence.objects.filter(
+                product_id__in=product_ids,
+                other_id__in=product_ids
+            ).exclude(product_id=F('other_id')).update(count=F('count') + 1)
+            
+            RecommendationService.refresh_top_k(product_ids)
+    
+    @staticmethod
+    def refresh_top_k(product_ids):
+        top_k = RecommendationService.TOP_K
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(
+                product_id=product_id,
+                neighbours=[
+                    list(pair) for pair in ProductCooccurrence.objects.filter(
+                        product_id=product_id
+                    ).order_by('-count', 'other_id').values_list('other_id', 'count')[:top_k]
+                ]
+            )
+            for product_id in product_ids
+        ], update_conflicts=True, unique_fields=['product'], update_fields=['neighbours', 'updated_at'])
+
+class PriceIndexService:
+    WINDOW_WEEKS = 4
+    BATCH_SIZE = 1000
+    CACHE_TIMEOUT = 600
+    CACHE_VERSION_KEY = 'price_index:version'
+    # Product unit -> (normalized unit, normalized units per product unit)
+    UNIT_NORMALIZATION = {
+        'kg': ('kg', 1.0),
+        'lb': ('kg', 0.45359237),
+        'crt': ('crt', 1.0),
+        'bnd': ('bnd', 1.0),
+        'dz': ('ea', 12.0),
+    }
+    
+    @staticmethod
+    def extract(items):
+        # Columnar extract: price, quantity, unit, category, region, sale week
+        return list(items.filter(
+            order__status__in=RecommendationService.PAID_STATUSES,
+            quantity__gt=0
+        ).annotate(
+            week=TruncWeek('order__created_at', output_field=models.DateField())
+        ).values_list(
+            'price', 'quantity', 'product__unit', 'product__category_id',
+            'product__farmer__region', 'week'
+        ))
+    
+    @staticmethod
+    def compute(rows, first_week=None, last_week=None):
+        import numpy as np
+        
+        if not rows:
+            return []
+        prices, quantities, units, categories, regions, weeks = zip(*rows)
+        
+        # Normalize to price per kg / crate / bundle / each
+        unit_names, unit_idx = np.unique(np.array(units), return_inverse=True)
+        mapping = [PriceIndexService.UNIT_NORMALIZATION[name] for name in unit_names]
+        normalized_names, normalized_idx = np.unique([name for name, _ in mapping], return_inverse=True)
+        factor = np.array([factor for _, factor in mapping])[unit_idx]
+        price = np.array(prices, dtype=float) / factor
+        weight = np.array(quantities, dtype=float) * factor
+        normalized_unit = normalized_idx[unit_idx]
+        region_names, region_idx = np.unique(np.array(regions), return_inverse=True)
+        category = np.array(categories, dtype=np.int64)
+        day = np.array(weeks, dtype='datetime64[D]').astype(np.int64)
+        
+        # Each sale also counts toward the following weeks of its rolling window
+        window = PriceIndexService.WINDOW_WEEKS
+        source = np.repeat(np.arange(len(price)), window)
+        target_day = day[source] + np.tile(np.arange(window) * 7, len(price))
+        keep = np.ones(len(source), dtype=bool)
+        if first_week is not None:
+            keep &= target_day >= np.datetime64(first_week, 'D').astype(np.int64)
+        if last_week is not None:
+            keep &= target_day <= np.datetime64(last_week, 'D').astype(np.int64)
+        source, target_day = source[keep], target_day[keep]
+        if not len(source):
+            return []
+        
+        keys = np.column_stack([
+            category[source], region_idx[source], normalized_unit[source], target_day
+        ])
+        groups, group = np.unique(keys, axis=0, return_inverse=True)
+        group = group.ravel()
+        
+        # Quantity-weighted percentiles: sort by (group, price), then locate each
+        # percentile on a per-group cumulative weight fraction offset by group id
+        order = np.lexsort((price[source], group))
+        group, p, w = group[order], price[source][order], weight[source][order]
+        totals = np.bincount(group, weights=w)
+        cumulative = np.cumsum(w)
+        before = cumulative - w
+        group_start = before[np.searchsorted(group, np.arange(len(groups)))]
+        position = group + (cumulative - group_start[group]) / totals[group]
+        
+        def percentile(q):
+            index = np.searchsorted(position, np.arange(len(groups)) + q, side='left')
+            return p[np.minimum(index, len(p) - 1)]
+        
+        p25, median, p75 = percentile(0.25), percentile(0.5), percentile(0.75)
+        counts = np.bincount(group)
+        epoch = np.datetime64('1970-01-01', 'D')
+        
+        return [
+            MarketPriceIndex(
+                category_id=int(groups[i, 0]),
+                region=str(region_names[groups[i, 1]]),
+                unit=str(normalized_names[groups[i, 2]]),
+                week_start=(epoch + int(groups[i, 3])).item(),
+                median_price=Decimal(f"{median[i]:.2f}"),
+                p25_price=Decimal(f"{p25[i]:.2f}"),
+                p75_price=Decimal(f"{p75[i]:.2f}"),
+                quantity=Decimal(f"{totals[i]:.3f}"),
+                sample_count=int(counts[i])
+            )
+            for i in range(len(groups))
+        ]
+    
+    @staticmethod
+    def current_week():
+        today = timezone.localdate()
+        return today - timedelta(days=today.weekday())
+    
+    @staticmethod
+    def rebuild():
+        rows = PriceIndexService.extract(OrderItem.objects.all())
+        entries = PriceIndexService.compute(rows, last_week=PriceIndexService.current_week())
+        with transaction.atomic():
+            MarketPriceIndex.objects.all().delete()
+            MarketPriceIndex.objects.bulk_create(entries, batch_size=PriceIndexService.BATCH_SIZE)
+        PriceIndexService.invalidate_cache()
+        return len(entries)
+    
+    @staticmethod
+    def record_order(order):
+        # Incremental update: recompute only the weeks whose window contains this order
+        items = list(order.items.values_list('product__category_id', 'product__farmer__region'))
+        categories = {category for category, _ in items}
+        regions = {region for _, region in items}
+        window_days = (PriceIndexService.WINDOW_WEEKS - 1) * 7
+        created = timezone.localtime(order.created_at).date()
+        first_week = created - timedelta(days=created.weekday())
+        last_week = min(first_week + timedelta(days=window_days), PriceIndexService.current_week())
+        
+        rows = PriceIndexService.extract(OrderItem.objects.filter(
+            product__category_id__in=categories,
+            product__farmer__region__in=regions,
+            order__created_at__date__gte=first_week - timedelta(days=window_days),
+            order__created_at__date__lt=last_week + timedelta(days=7)
+        ))
+        entries = PriceIndexService.compute(rows, first_week=first_week, last_week=last_week)
+        MarketPriceIndex.objects.bulk_create(
+            entries,
+            batch_size=PriceIndexService.BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['category', 'region', 'unit', 'week_start'],
+            update_fields=['median_price', 'p25_price', 'p75_price', 'quantity', 'sample_count', 'updated_at']
+        )
+        PriceIndexService.invalidate_cache()
+    
+    @staticmethod
+    def invalidate_cache():
+        # Bumping the version orphans every cached index response
+        cache.add(PriceIndexService.CACHE_VERSION_KEY, 0, timeout=None)
+        cache.incr(PriceIndexService.CACHE_VERSION_KEY)
+    
+    @staticmethod
+    def regional_index(region, category_code=None, weeks=8):
+        version = cache.get(PriceIndexService.CACHE_VERSION_KEY, 0)
+        cache_key = f'price_index:{version}:{region}:{category_code}:{weeks}'
+        
+        def load():
+            entries = MarketPriceIndex.objects.filter(
+                region=region,
+                week_start__gte=PriceIndexService.current_week() - timedelta(weeks=weeks - 1)
+            )
+            if category_code:
+                entries = entries.filter(category__code=category_code)
+            return [{
+                'category': entry['category__code'],
+                'unit': entry['unit'],
+                'week_start': entry['week_start'].isoformat(),
+                'median_price': str(entry['median_price']),
+                'p25_price': str(entry['p25_price']),
+                'p75_price': str(entry['p75_price']),
+                'quantity': str(entry['quantity']),
+                'sample_count': entry['sample_count']
+            } for entry in entries.order_by('category__code', 'unit', 'week_start').values(
+                'category__code', 'unit', 'week_start', 'median_price',
+                'p25_price', 'p75_price', 'quantity', 'sample_count'
+            )]
+        
+        return cache.get_or_set(cache_key, load, PriceIndexService.CACHE_TIMEOUT)
+
+# Keep the price book in step with price, tax and rate changes
+@receiver(post_save, sender=Product)
+def refresh_product_price_book(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'price' not in update_fields:
+        return
+    PriceBookService.refresh_product(instance)
+
+@receiver(post_save, sender=CARICOMCountry)
+def refresh_country_price_book(sender, instance, **kwargs):
+    PriceBookService.refresh_country(instance)
+
+@receiver(post_save, sender=FXRate)
+def refresh_currency_price_book(sender, instance, **kwargs):
+    for country in CARICOMCountry.objects.filter(currency_code=instance.currency_code):
+        PriceBookService.refresh_country(country)
+
 # ======================
 # API VIEWS (UPDATED WITH NEW FUNCTIONALITY)
 # ======================
@@ -315,15 +970,33 @@ class CartAPI(APIView):
     def get(self, request):
         cart, _ = Cart.objects.get_or_create(user=request.user, is_active=True)
         items = cart.items.select_related('product').all()
+        local_prices = PriceBookService.local_prices(
+            request.user.country_id,
+            [item.product_id for item in items]
+        )
+        
+        # Local total only when every item is priced in the same local currency
+        local_currencies = {entry.currency_code for entry in local_prices.values()}
+        if items and len(local_prices) == len({item.product_id for item in items}) and len(local_currencies) == 1:
+            local_currency = local_currencies.pop()
+            local_total = str(sum(local_prices[item.product_id].price * item.quantity for item in items))
+        else:
+            local_currency = local_total = None
         
         cart_data = {
             'id': cart.id,
             'total': cart.total(),
+            'currency': settings.BASE_CURRENCY,
+            'local_total': local_total,
+            'local_currency': local_currency,
             'items': [{
                 'id': item.id,
                 'product_id': item.product.id,
                 'name': item.product.name,
                 'price': str(item.product.price),
+                'local_price': str(local_prices[item.product_id].price) if item.product_id in local_prices else None,
+                'local_price_with_tax': str(local_prices[item.product_id].price_with_tax) if item.product_id in local_prices else None,
+                'local_currency': local_prices[item.product_id].currency_code if item.product_id in local_prices else None,
                 'quantity': item.quantity,
                 'subtotal': str(item.product.price * item.quantity)
             } for item in items]
@@ -410,7 +1083,7 @@ class OrderAPI(APIView):
                     
                     # Update product quantity
                     item.product.quantity = F('quantity') - item.quantity
-                    item.product.save()
+                    item.product.save(update_fields=['quantity', 'updated_at'])
                 
                 # Create payment intent
                 payment_service = PaymentService()
@@ -476,8 +1149,23 @@ def payment_webhook(request):
     if event['type'] == 'payment_intent.succeeded':
         payment_intent = event['data']['object']
         order = Order.objects.get(payment_intent_id=payment_intent['id'])
-        order.status = 'paid'
-        order.save()
+        
+        # Stripe may redeliver the event, even concurrently; the conditional
+        # update lets exactly one delivery move the order from pending to paid.
+        # Counting co-purchases shares its transaction, so a failure leaves the
+        # order pending and the redelivery does the work.
+        with transaction.atomic():
+            newly_paid = Order.objects.filter(pk=order.pk, status='pending').update(
+                status='paid',
+                updated_at=timezone.now()
+            ) == 1
+            if newly_paid:
+                RecommendationService.record_order(order)
+        
+        if newly_paid:
+            order.status = 'paid'
+            # Recomputed from scratch for the affected weeks, so safe outside the transaction
+            PriceIndexService.record_order(order)
         
         # Send notifications
         NotificationService.send_notification(
@@ -526,6 +1214,64 @@ class ReviewAPI(APIView):
         except Order.DoesNotExist:
             return JsonResponse({'error': 'Order not found or not eligible for review'}, status=404)
 
+class RecommendationAPI(APIView):
+    @login_required
+    def get(self, request, product_id):
+        neighbours = ProductRecommendation.objects.filter(
+            product_id=product_id
+        ).values_list('neighbours', flat=True).first()
+        
+        return JsonResponse({
+            'product_id': product_id,
+            'recommendations': [
+                {'product_id': other_id, 'count': count}
+                for other_id, count in neighbours or []
+            ]
+        })
+
+class EventStreamAPI(APIView):
+    # Server-sent events replacing dashboard polling for order and payment updates
+    HEARTBEAT_INTERVAL = 15
+    RECONNECT_MS = 3000
+    MAX_STREAM_SECONDS = 300  # Clients reconnect with Last-Event-ID, releasing the worker
+    
+    @login_required
+    def get(self, request):
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            last_event_id = None  # Fresh stream: start at the current sequence, no replay
+        
+        # The stream never touches the database; release the connection now rather
+        # than holding it until the response closes
+        connection.close()
+        
+        response = StreamingHttpResponse(
+            self.stream(request.user.id, last_event_id),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Disable nginx proxy buffering
+        return response
+    
+    def stream(self, user_id, last_event_id):
+        channel = get_event_channel()
+        if last_event_id is None:
+            last_event_id = channel.latest_id(user_id)
+        deadline = time.monotonic() + self.MAX_STREAM_SECONDS
+        yield f"retry: {self.RECONNECT_MS}\n\n"
+        
+        while time.monotonic() < deadline:
+            events = channel.read(user_id, last_event_id, timeout=self.HEARTBEAT_INTERVAL)
+            if not events:
+                yield ": heartbeat\n\n"
+                continue
+            
+            for event in events:
+                last_event_id = event['id']
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
 # ======================
 # SHIPPING INTEGRATION
 # ======================
@@ -553,6 +1299,117 @@ class ShippingAPI(APIView):
         except Order.DoesNotExist:
             return JsonResponse({'error': 'Order not found'}, status=404)
 
+class BulkShippingAPI(APIView):
+    MAX_ORDERS = 1000
+    
+    @login_required
+    def post(self, request):
+        # Accepts JSON {"shipments": [{"order_id": ..., "tracking_number": ...}]} or
+        # [[order_id, tracking_number], ...], a text/csv body, or a multipart "file" upload
+        content_type = request.content_type or ''
+        try:
+            if content_type.startswith('multipart/'):
+                if 'file' not in request.FILES:
+                    return JsonResponse({'error': 'CSV file required'}, status=400)
+                shipments = self.parse_csv(io.TextIOWrapper(request.FILES['file'], encoding='utf-8'))
+            elif content_type == 'text/csv':
+                shipments = self.parse_csv(io.StringIO(request.body.decode('utf-8')))
+            else:
+                data = json.loads(request.body)
+                shipments = data.get('shipments', []) if isinstance(data, dict) else data
+        except UnicodeDecodeError:
+            return JsonResponse({'error': 'CSV must be UTF-8 encoded'}, status=400)
+        except (ValueError, csv.Error):
+            return JsonResponse({'error': 'Malformed request body'}, status=400)
+        
+        if not isinstance(shipments, list):
+            return JsonResponse({'error': 'shipments must be a list'}, status=400)
+        if not shipments:
+            return JsonResponse({'error': 'No shipments provided'}, status=400)
+        if len(shipments) > self.MAX_ORDERS:
+            return JsonResponse({'error': f'At most {self.MAX_ORDERS} orders per request'}, status=400)
+        
+        # Validate input before touching the database
+        results = []
+        requested = {}
+        for shipment in shipments:
+            if isinstance(shipment, dict):
+                order_id, tracking_number = shipment.get('order_id'), shipment.get('tracking_number')
+            elif isinstance(shipment, (list, tuple)) and len(shipment) == 2:
+                order_id, tracking_number = shipment
+            else:
+                results.append({'order_id': None, 'error': 'Invalid shipment'})
+                continue
+            tracking_number = str(tracking_number or '').strip()
+            result = {'order_id': order_id}
+            try:
+                if isinstance(order_id, (bool, float)):
+                    raise TypeError
+                order_id = result['order_id'] = int(order_id)
+            except (TypeError, ValueError):
+                result['error'] = 'Invalid order id'
+            else:
+                if not tracking_number:
+                    result['error'] = 'Tracking number required'
+                elif len(tracking_number) > Order._meta.get_field('tracking_number').max_length:
+                    result['error'] = 'Tracking number too long'
+                elif order_id in requested:
+                    result['error'] = 'Duplicate order'
+                else:
+                    requested[order_id] = tracking_number
+            results.append(result)
+        
+        with transaction.atomic():
+            # Ownership and status for every order in one query
+            orders = {
+                order.id: order
+                for order in Order.objects.select_for_update(of=('self',)).select_related('buyer').filter(
+                    id__in=requested,
+                    farmer=request.user
+                )
+            }
+            
+            now = timezone.now()
+            shipped = []
+            for result in results:
+                if 'error' in result:
+                    result['status'] = 'error'
+                    continue
+                order = orders.get(result['order_id'])
+                if order is None:
+                    result.update(status='error', error='Order not found')
+                elif order.status != 'paid':
+                    result.update(status='error', error=f'Order is {order.status}')
+                else:
+                    order.tracking_number = requested[order.id]
+                    order.status = 'shipped'
+                    order.updated_at = now  # bulk_update skips auto_now
+                    shipped.append(order)
+                    result['status'] = 'shipped'
+            
+            Order.objects.bulk_update(shipped, ['tracking_number', 'status', 'updated_at'], batch_size=500)
+            NotificationService.send_bulk_notifications([
+                (
+                    order.buyer,
+                    f"Order #{order.id} shipped. Tracking: {order.tracking_number}",
+                    'order',
+                    order.id
+                )
+                for order in shipped
+            ])
+        
+        return JsonResponse({'shipped': len(shipped), 'results': results})
+    
+    @staticmethod
+    def parse_csv(stream):
+        rows = [row for row in csv.reader(stream) if row]
+        if rows and rows[0][0].strip().lower() == 'order_id':
+            rows = rows[1:]
+        return [
+            {'order_id': row[0].strip(), 'tracking_number': row[1] if len(row) > 1 else ''}
+            for row in rows
+        ]
+
 # ======================
 # REPORTING & ANALYTICS
 # ======================
@@ -585,6 +1442,22 @@ class FarmerAnalyticsAPI(APIView):
             'top_products': list(top_products)
         })
 
+class MarketPriceAPI(APIView):
+    @login_required
+    def get(self, request):
+        region = request.GET.get('region') or request.user.region
+        category_code = request.GET.get('category')
+        try:
+            weeks = min(max(int(request.GET.get('weeks', 8)), 1), 52)
+        except ValueError:
+            return JsonResponse({'error': 'weeks must be an integer'}, status=400)
+        
+        return JsonResponse({
+            'region': region,
+            'window_weeks': PriceIndexService.WINDOW_WEEKS,
+            'prices': PriceIndexService.regional_index(region, category_code, weeks)
+        })
+
 # ======================
 # SYSTEM INITIALIZATION (UPDATED)
 # ======================
@@ -623,6 +1496,9 @@ def initialize_system():
             }
         )
     
+    # FX rates for the multi-currency price book
+    PriceBookService.load_fx_rates()
+    
     # Configure Stripe
     stripe.api_key = settings.STRIPE_SECRET_KEY
 
@@ -642,6 +1518,10 @@ if __name__ == "__main__":
         SHIPPING_BASE_COST=50.00,
         SHIPPING_PER_KM=1.20,
         
+        # Multi-currency price book
+        BASE_CURRENCY='TTD',
+        FX_RATES_FILE='fx_rates.json',
+        
         # Email configuration
         EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
         EMAIL_HOST='smtp.yourdomain.com',
@@ -650,6 +1530,9 @@ if __name__ == "__main__":
         EMAIL_HOST_USER='your_email@domain.com',
         EMAIL_HOST_PASSWORD='your_email_password',
         
+        # Event stream backend ('memory' for tests, 'cache' across workers)
+        EVENT_CHANNEL_BACKEND='cache',
+        
         # Search configuration
         USE_POSTGRES=True,  # Enable PostgreSQL full-text search
     )
@@ -0,0 +1,47 @@
+# benchmark_ratelimit.py
+# Per-request overhead of RateLimitMiddleware.
+# Usage: python benchmark_ratelimit.py [iterations]
+# Set REDIS_URL to measure against Redis instead of the local-memory cache.
+import os
+import sys
+import time
+import django
+from django.conf import settings
+
+if os.environ.get('REDIS_URL'):
+    CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']}
+else:
+    CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+settings.configure(
+    CACHES={'default': CACHE},
+    ALLOWED_HOSTS=['testserver'],
+    # Limit high enough that every request is let through
+    RATE_LIMITS={'/api/cart/': {'methods': ['POST'], 'limit': 10 ** 9, 'window': 60}},
+)
+django.setup()
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+from marketplace.middleware import RateLimitMiddleware
+
+def view(request):
+    return HttpResponse()
+
+def run(handler, request, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        handler(request)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    request = RequestFactory().post('/api/cart/', REMOTE_ADDR='10.0.0.1')
+    middleware = RateLimitMiddleware(view)
+
+    baseline = run(view, request, iterations)
+    limited = run(middleware, request, iterations)
+    print(f"Cache backend:   {CACHE['BACKEND']}")
+    print(f"Without limiter: {baseline:.1f} us/request")
+    print(f"With limiter:    {limited:.1f} us/request")
+    print(f"Overhead:        {limited - baseline:.1f} us/request")
@@ -0,0 +1,10 @@
+# marketplace/management/commands/build_price_index.py
+from django.core.management.base import BaseCommand
+from marketplace.models import PriceIndexService
+
+class Command(BaseCommand):
+    help = "Rebuild the regional market price index from paid orders"
+
+    def handle(self, *args, **options):
+        entries = PriceIndexService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Price index rebuilt with {entries} entries"))
@@ -0,0 +1,10 @@
+# marketplace/management/commands/build_recommendations.py
+from django.core.management.base import BaseCommand
+from marketplace.models import RecommendationService
+
+class Command(BaseCommand):
+    help = "Rebuild product co-occurrence counts and top-K recommendations from paid orders"
+
+    def handle(self, *args, **options):
+        products = RecommendationService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Recommendations rebuilt for {products} products"))
@@ -0,0 +1,7 @@
+# gunicorn.conf.py
+# Picked up automatically by gunicorn from the working directory (/app)
+
+def post_fork(server, worker):
+    # psycopg2 blocks the whole gevent worker unless patched to yield on I/O
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
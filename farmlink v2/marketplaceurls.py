@@ -1,12 +1,16 @@
 # marketplace/urls.py
 from django.urls import path
-from .views import CartAPI, OrderAPI, ReviewAPI, ShippingAPI, FarmerAnalyticsAPI, payment_webhook
+from .views import CartAPI, OrderAPI, ReviewAPI, ShippingAPI, BulkShippingAPI, FarmerAnalyticsAPI, MarketPriceAPI, RecommendationAPI, EventStreamAPI, payment_webhook
 
 urlpatterns = [
     path('cart/', CartAPI.as_view()),
     path('order/', OrderAPI.as_view()),
     path('review/<int:order_id>/', ReviewAPI.as_view()),
     path('shipping/<int:order_id>/', ShippingAPI.as_view()),
+    path('shipping/bulk/', BulkShippingAPI.as_view()),
     path('analytics/', FarmerAnalyticsAPI.as_view()),
+    path('market-prices/', MarketPriceAPI.as_view()),
+    path('products/<int:product_id>/recommendations/', RecommendationAPI.as_view()),
+    path('events/', EventStreamAPI.as_view()),
     path('webhook/payment/', payment_webhook),
 ]
\ No newline at end of file
@@ -1,5 +1,12 @@
 # marketplace/middleware.py
-from django.http import HttpResponseForbidden
+import math
+import time
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponseForbidden, JsonResponse
+
+logger = logging.getLogger(__name__)
 
 class MediaAuthMiddleware:
     def __init__(self, get_response):
@@ -9,4 +16,71 @@ class MediaAuthMiddleware:
         if request.path.startswith('/protected_media/'):
             if not request.user.is_authenticated:
                 return HttpResponseForbidden()
-        return self.get_response(request)
\ No newline at end of file
+        return self.get_response(request)
+
+class RateLimitMiddleware:
+    # Sliding-window counter kept in the shared cache. The previous window's
+    # count is weighted by how much of it still overlaps the sliding window.
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Longest prefix wins when routes overlap
+        self.rules = sorted(
+            getattr(settings, 'RATE_LIMITS', {}).items(),
+            key=lambda rule: len(rule[0]),
+            reverse=True
+        )
+
+    def __call__(self, request):
+        for prefix, rule in self.rules:
+            if request.path.startswith(prefix) and request.method in rule.get('methods', ['POST']):
+                try:
+                    retry_after = self.hit(request, prefix, rule['limit'], rule['window'])
+                except Exception as e:
+                    # Fail open: a cache outage must not take checkout down with it
+                    logger.error(f"Rate limiter cache error: {str(e)}")
+                    retry_after = 0
+                if retry_after:
+                    response = JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+                    response['Retry-After'] = str(retry_after)
+                    return response
+                break
+        return self.get_response(request)
+
+    @staticmethod
+    def client_key(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        # X-Real-IP is client-controlled unless every request comes through nginx
+        if getattr(settings, 'RATE_LIMIT_TRUST_X_REAL_IP', False) and request.META.get('HTTP_X_REAL_IP'):
+            return 'ip:' + request.META['HTTP_X_REAL_IP']
+        return 'ip:' + request.META.get('REMOTE_ADDR', '')
+
+    def hit(self, request, prefix, limit, window):
+        now = time.time()
+        current = int(now // window)
+        base = f'ratelimit:{prefix}:{self.client_key(request)}'
+        key = f'{base}:{current}'
+
+        # incr() is atomic on the shared cache; add() only wins for the first hit of a window
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            count = 1 if cache.add(key, 1, timeout=window * 2) else cache.incr(key)
+
+        elapsed = now - current * window
+        previous = cache.get(f'{base}:{current - 1}', 0)
+        if previous * (window - elapsed) / window + count <= limit:
+            return 0
+
+        # Rejected requests do not count against the client
+        count = cache.decr(key)
+        return max(1, math.ceil(round(self.retry_after(limit, window, elapsed, previous, count), 6)))
+
+    @staticmethod
+    def retry_after(limit, window, elapsed, previous, count):
+        # Seconds until previous * (window - t) / window + count + 1 <= limit
+        if count + 1 <= limit:
+            return window * (1 - (limit - count - 1) / previous) - elapsed
+        # Not within this window: wait for it to roll over and carry the weight of `count`
+        return (window - elapsed) + max(0, window * (1 - (limit - 1) / count))
@@ -6,4 +6,9 @@ psycopg2-binary==2.9.6
 geopy==2.3.0
 Pillow==9.5.0
 gunicorn==20.1.0
-python-dotenv==1.0.0
\ No newline at end of file
+gevent==22.10.2
+psycogreen==1.0.2
+python-dotenv==1.0.0
+numpy==1.24.3
+scipy==1.10.1
+redis==4.5.4
\ No newline at end of file
@@ -25,6 +25,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'marketplace.middleware.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -45,12 +46,36 @@ DATABASES = {
 
 AUTH_USER_MODEL = 'marketplace.Farmer'
 
+# Shared cache (rate limiting state must be visible to every gunicorn worker)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    }
+}
+
+# Rate limits per path prefix: requests allowed per sliding window (seconds)
+RATE_LIMITS = {
+    '/api/cart/': {'methods': ['POST'], 'limit': 60, 'window': 60},
+    '/api/order/': {'methods': ['POST'], 'limit': 10, 'window': 60},
+}
+# Only enable when gunicorn is reachable solely through the nginx proxy,
+# which sets X-Real-IP; otherwise clients can pick their own rate limit bucket
+RATE_LIMIT_TRUST_X_REAL_IP = False
+
+# Server-sent event channel: 'cache' shares events across workers, 'memory' is for tests
+EVENT_CHANNEL_BACKEND = 'cache'
+
 # Payment and Shipping Configuration
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
 SHIPPING_BASE_COST = 50.00
 SHIPPING_PER_KM = 1.20
 
+# Multi-currency price book (rates per 1 TTD, the catalog's base currency)
+BASE_CURRENCY = 'TTD'
+FX_RATES_FILE = os.path.join(BASE_DIR, 'fx_rates.json')
+
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.yourprovider.com'